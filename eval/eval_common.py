@@ -0,0 +1,161 @@
+"""
+Helpers shared by the eval scripts (evaluate.py, evaluate_deepeval.py,
+generate_benchmarks.py, generate_dataset.py).
+
+The scripts are run from this directory, so they import it as a plain module:
+
+    from eval_common import load_json, make_session, ...
+"""
+
+import functools
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback
+    orjson = None  # type: ignore[assignment]
+
+SCRIPT_DIR = Path(__file__).parent
+SEARCH_LIMIT = 10
+
+
+# ─── JSON ──────────────────────────────────────────────────────────────────────
+
+def loads_json(data: Any) -> Any:
+    """Parse JSON from str or bytes (orjson when available)."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps_json(obj: Any, indent: bool = False) -> bytes:
+    """
+    Serialize obj to JSON bytes (orjson when available). Non-str dict keys
+    are stringified the way stdlib json does (None -> "null") rather than
+    raising.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+
+def load_json(path: Path) -> Any:
+    """Parse a JSON file."""
+    return loads_json(path.read_bytes())
+
+
+def dump_json(path: Path, obj: Any) -> None:
+    """
+    Write obj to path as indented JSON. The document is serialized in memory,
+    written to a sibling temp file and renamed over path, so a crash mid-write
+    never leaves a truncated file behind.
+    """
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(dumps_json(obj, indent=True))
+    os.replace(tmp, path)
+
+
+def response_json(resp: requests.Response) -> Any:
+    """Decode a response body."""
+    return loads_json(resp.content)
+
+
+# ─── HTTP ──────────────────────────────────────────────────────────────────────
+
+class CodeprismError(RuntimeError):
+    """A codeprism API call failed; str(exc) is the message to show the user."""
+
+
+def unreachable(server: str) -> CodeprismError:
+    """The error reported when server refuses or drops the connection."""
+    return CodeprismError(
+        f"[ERROR] Cannot reach codeprism at {server}.\n"
+        "        Make sure the server is running: cd codeprism && pnpm dev"
+    )
+
+
+def make_session(retry: bool = True) -> requests.Session:
+    """
+    Keep-alive session with a pool large enough for the scripts' thread pools.
+    With retry, transient 502/503/504s are retried twice with a short backoff.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            raise_on_status=False,  # let raise_for_status() report the final response
+        ) if retry else 0,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# ─── Search cache ──────────────────────────────────────────────────────────────
+# Opt-in (--search-cache): repeated runs while tuning judges hit /api/search with
+# identical queries, so successful responses can be memoized on disk for a day.
+# Off by default because the harness exists to measure search after reindexing
+# or retuning; keys include an index fingerprint so a reindex that changes the
+# card/flow counts never reuses old results.
+
+SEARCH_CACHE_DIR = SCRIPT_DIR / ".search_cache"
+SEARCH_CACHE_TTL = 24 * 60 * 60  # seconds
+_search_cache = None  # opened by open_search_cache(); None means caching is off
+_index_fingerprint = ""
+
+
+def index_fingerprint(health: dict) -> str:
+    """Identify the indexed data behind a server from its /api/health payload."""
+    return f"cards={health.get('cards')}|flows={health.get('flows')}"
+
+
+def open_search_cache(fingerprint: str) -> None:
+    """
+    Enable the on-disk search cache for this index fingerprint. Without
+    diskcache installed this warns and leaves caching off.
+    """
+    global _search_cache, _index_fingerprint
+    try:
+        from diskcache import Cache
+    except ImportError:
+        print("[WARN] --search-cache ignored: diskcache is not installed (pip install diskcache)")
+        return
+    _search_cache = Cache(str(SEARCH_CACHE_DIR))
+    _index_fingerprint = fingerprint
+
+
+def cached_search(fn: Callable[..., List[dict]]) -> Callable[..., List[dict]]:
+    """Cache fn(server, query, limit) results keyed by (index, server, query, limit)."""
+    @functools.wraps(fn)
+    def wrapper(server: str, query: str, limit: int = SEARCH_LIMIT) -> List[dict]:
+        if _search_cache is None:
+            return fn(server, query, limit)
+        key = hashlib.sha1(f"{_index_fingerprint}|{server}|{query}|{limit}".encode()).hexdigest()
+        if not os.environ.get("AI_CACHE_FORCE_REFRESH"):
+            hit = _search_cache.get(key)
+            if hit is not None:
+                return hit
+        result = fn(server, query, limit)
+        if result:  # never cache empty/failed searches
+            _search_cache.set(key, result, expire=SEARCH_CACHE_TTL)
+        return result
+    return wrapper
+
+
+# ─── Test cases ────────────────────────────────────────────────────────────────
+
+def normalize_test_case(test_case: dict) -> None:
+    """Cache lowercased expected flows / file fragments on the test case."""
+    test_case["_expected_flows_lc"] = frozenset(f.lower() for f in test_case.get("expected_flows", []))
+    test_case["_expected_files_lc"] = tuple(f.lower() for f in test_case.get("expected_file_fragments", []))
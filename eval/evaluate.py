@@ -31,42 +31,63 @@ Output:
 """
 
 import argparse
-import json
 import os
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
+from eval_common import (
+    SEARCH_LIMIT,
+    CodeprismError,
+    cached_search,
+    dump_json,
+    index_fingerprint,
+    load_json,
+    make_session,
+    normalize_test_case,
+    open_search_cache,
+    unreachable,
+)
+
 CODEPRISM_DEFAULT = "http://localhost:4000"
 DATASET_PATH = Path(__file__).parent / "golden_dataset.json"
 RESULTS_PATH = Path(__file__).parent / "eval_results.json"
-SEARCH_LIMIT = 10
+RAGAS_CACHE_DIR = Path(__file__).parent / ".ragas_cache"
+SEARCH_CONCURRENCY = 8
+PARALLEL_DET_THRESHOLD = 256  # below this, process start-up costs more than it saves
 
 
 # ─── HTTP helpers ──────────────────────────────────────────────────────────────
 
+SESSION = make_session()
+
+
+@cached_search
 def search(server: str, query: str, limit: int = SEARCH_LIMIT) -> List[dict]:
-    """Call GET /api/search and return the results list."""
+    """
+    Call GET /api/search and return the results list. Raises CodeprismError
+    (rather than exiting) since it runs on worker threads; main reports it.
+    """
     url = f"{server}/api/search"
     try:
-        resp = requests.get(url, params={"q": query, "limit": limit}, timeout=30)
+        resp = SESSION.get(url, params={"q": query, "limit": limit}, timeout=30)
         resp.raise_for_status()
         return resp.json().get("results", [])
     except requests.exceptions.ConnectionError:
-        print(f"\n[ERROR] Cannot reach codeprism at {server}.")
-        print("        Make sure the server is running: cd codeprism && pnpm dev")
-        sys.exit(1)
+        raise unreachable(server) from None
     except requests.exceptions.HTTPError as e:
-        print(f"\n[ERROR] HTTP {e.response.status_code} from /api/search: {e.response.text}")
-        sys.exit(1)
+        raise CodeprismError(
+            f"[ERROR] HTTP {e.response.status_code} from /api/search: {e.response.text}"
+        ) from None
 
 
 def check_health(server: str) -> dict:
     try:
-        resp = requests.get(f"{server}/api/health", timeout=10)
+        resp = SESSION.get(f"{server}/api/health", timeout=10)
         resp.raise_for_status()
         return resp.json()
     except Exception as e:
@@ -85,34 +106,29 @@ def compute_deterministic(test_case: dict, results: List[dict]) -> dict:
       found_flows     : list of expected flows that were actually found
       missing_flows   : list of expected flows not found
     """
-    expected_flows = set(f.lower() for f in test_case.get("expected_flows", []))
-    expected_files = [f.lower() for f in test_case.get("expected_file_fragments", [])]
+    if "_expected_flows_lc" not in test_case:
+        normalize_test_case(test_case)
+    expected_flows = test_case["_expected_flows_lc"]
+    expected_files = test_case["_expected_files_lc"]
     k = len(results)
 
-    # Gather all flows and source files from results
-    result_flows = set()
-    all_source_files: List[str] = []
-    for r in results:
-        flow = (r.get("flow") or "").lower()
-        result_flows.add(flow)
-        for sf in r.get("source_files", []):
-            all_source_files.append(sf.lower())
+    # Gather all flows and source files from results (lowercased once)
+    result_flows_list = [(r.get("flow") or "").lower() for r in results]
+    result_flows = set(result_flows_list)
+    file_paths = [sf.lower() for r in results for sf in r.get("source_files", [])]
 
     # Flow hit rate
     found_flows = expected_flows & result_flows
     missing_flows = expected_flows - result_flows
     flow_hit_rate = len(found_flows) / len(expected_flows) if expected_flows else 1.0
 
-    # File fragment hit rate (check if fragment appears in any source file path)
-    all_files_combined = " ".join(all_source_files)
-    found_file_frags = [f for f in expected_files if f in all_files_combined]
+    # File fragment hit rate (check if fragment appears in any source file path;
+    # any() stops at the first matching path)
+    found_file_frags = [f for f in expected_files if any(f in p for p in file_paths)]
     file_hit_rate = len(found_file_frags) / len(expected_files) if expected_files else 1.0
 
     # Precision@K: how many retrieved results belong to an expected flow
-    relevant_results = sum(
-        1 for r in results
-        if (r.get("flow") or "").lower() in expected_flows
-    )
+    relevant_results = sum(1 for flow in result_flows_list if flow in expected_flows)
     precision_at_k = relevant_results / k if k > 0 else 0.0
 
     return {
@@ -127,16 +143,63 @@ def compute_deterministic(test_case: dict, results: List[dict]) -> dict:
 
 # ─── Ragas metrics ─────────────────────────────────────────────────────────────
 
-def run_ragas(test_cases: List[dict], all_results: Dict[str, List[dict]]) -> Dict[str, Any]:
+def run_ragas(
+    test_cases: List[dict],
+    all_results: Dict[str, List[dict]],
+    use_cache: bool = True,
+    concurrency: Optional[int] = None,
+) -> Dict[str, Any]:
     """
     Builds a Ragas Dataset from our test cases and runs context_precision
     and context_recall using Gemini Flash as the judge LLM.
 
+    With use_cache, judge responses are memoized in .ragas_cache/<model>/ so
+    re-runs over unchanged inputs with the same judge skip the LLM entirely. `concurrency` overrides
+    Ragas' max_workers; retries and timeouts stay at the library defaults.
+
     Returns a dict mapping test case id -> ragas scores, plus aggregate means.
     """
+    # Build dataset rows
+    rows: Dict[str, List] = {
+        "question": [],
+        "contexts": [],
+        "ground_truth": [],  # used by older Ragas
+        "reference": [],     # used by Ragas 0.4+ _LLMContextPrecisionWithReference
+    }
+
+    used_ids: List[str] = []
+    for tc in test_cases:
+        tc_id = tc["id"]
+        results = all_results.get(tc_id, [])
+        if not results:
+            continue
+
+        # Contexts = card title + content concatenated
+        contexts = []
+        for r in results:
+            title, content = r.get("title", ""), r.get("content", "")
+            ctx = f"{title}\n{content}" if title and content else (title or content)
+            if ctx.strip():
+                contexts.append(ctx)
+
+        if not contexts:
+            continue
+
+        rows["question"].append(tc["query"])
+        rows["contexts"].append(contexts)
+        rows["ground_truth"].append(tc["ground_truth"])
+        rows["reference"].append(tc["ground_truth"])
+        used_ids.append(tc_id)
+
+    if not rows["question"]:
+        print("[WARN] No Ragas rows to evaluate (all results were empty).")
+        return {}
+
+    # Heavy imports (datasets/Arrow, ragas) only once there is something to score.
     try:
         from datasets import Dataset
         from ragas import evaluate
+        from ragas.run_config import RunConfig
         # Ragas 0.4.x: use the private-but-stable _LLMContextPrecisionWithReference
         # and _LLMContextRecall (the public aliases are broken in 0.4.3).
         # Dataset column is "reference" not "ground_truth" for these metrics.
@@ -166,6 +229,18 @@ def run_ragas(test_cases: List[dict], all_results: Dict[str, List[dict]]) -> Dic
 
     ragas_llm = None
 
+    # Ragas >= 0.3 accepts a cache backend in llm_factory; older versions don't.
+    # Its cache keys cover the prompt but not which LLM answered, so each judge
+    # model gets its own directory.
+    def cache_kwargs(model: str) -> Dict[str, Any]:
+        if not use_cache:
+            return {}
+        try:
+            from ragas.cache import DiskCacheBackend
+        except ImportError:
+            return {}
+        return {"cache": DiskCacheBackend(cache_dir=str(RAGAS_CACHE_DIR / model))}
+
     # Ragas 0.4+ requires llm_factory with the native openai.OpenAI client.
     # DeepSeek and OpenAI both use the same client; Gemini uses google-generativeai.
     # Priority: DeepSeek → OpenAI → Gemini
@@ -174,7 +249,7 @@ def run_ragas(test_cases: List[dict], all_results: Dict[str, List[dict]]) -> Dic
             from openai import OpenAI
             from ragas.llms import llm_factory
             _client = OpenAI(api_key=deepseek_key, base_url="https://api.deepseek.com/v1")
-            ragas_llm = llm_factory("deepseek-chat", client=_client)
+            ragas_llm = llm_factory("deepseek-chat", client=_client, **cache_kwargs("deepseek-chat"))
             print("[Ragas] Using DeepSeek-V3 as judge LLM.")
         except Exception as e:
             print(f"[WARN] Could not initialize DeepSeek for Ragas: {e}")
@@ -183,7 +258,9 @@ def run_ragas(test_cases: List[dict], all_results: Dict[str, List[dict]]) -> Dic
         try:
             from openai import OpenAI
             from ragas.llms import llm_factory
-            ragas_llm = llm_factory("gpt-4o-mini", client=OpenAI(api_key=openai_key))
+            ragas_llm = llm_factory(
+                "gpt-4o-mini", client=OpenAI(api_key=openai_key), **cache_kwargs("gpt-4o-mini")
+            )
             print("[Ragas] Using GPT-4o-mini as judge LLM.")
         except Exception as e:
             print(f"[WARN] Could not initialize OpenAI for Ragas: {e}")
@@ -191,7 +268,7 @@ def run_ragas(test_cases: List[dict], all_results: Dict[str, List[dict]]) -> Dic
     if ragas_llm is None and google_key:
         try:
             from ragas.llms import llm_factory
-            ragas_llm = llm_factory("gemini-2.0-flash", api_key=google_key)
+            ragas_llm = llm_factory("gemini-2.0-flash", api_key=google_key, **cache_kwargs("gemini-2.0-flash"))
             print("[Ragas] Using Gemini 2.0 Flash as judge LLM.")
         except Exception as e:
             print(f"[WARN] Could not initialize Gemini for Ragas: {e}")
@@ -200,41 +277,41 @@ def run_ragas(test_cases: List[dict], all_results: Dict[str, List[dict]]) -> Dic
         print("[WARN] No LLM configured for Ragas. Set DEEPSEEK_API_KEY, GOOGLE_API_KEY, or OPENAI_API_KEY.")
         return {}
 
-    # Build dataset rows
-    rows: Dict[str, List] = {
-        "question": [],
-        "contexts": [],
-        "ground_truth": [],  # used by older Ragas
-        "reference": [],     # used by Ragas 0.4+ _LLMContextPrecisionWithReference
-    }
-
-    used_ids: List[str] = []
-    for tc in test_cases:
-        tc_id = tc["id"]
-        results = all_results.get(tc_id, [])
-        if not results:
-            continue
-
-        # Contexts = card title + content concatenated
-        contexts = []
-        for r in results:
-            ctx_parts = [r.get("title", ""), r.get("content", "")]
-            ctx = "\n".join(p for p in ctx_parts if p)
-            if ctx.strip():
-                contexts.append(ctx)
-
-        if not contexts:
-            continue
-
-        rows["question"].append(tc["query"])
-        rows["contexts"].append(contexts)
-        rows["ground_truth"].append(tc["ground_truth"])
-        rows["reference"].append(tc["ground_truth"])
-        used_ids.append(tc_id)
-
-    if not rows["question"]:
-        print("[WARN] No Ragas rows to evaluate (all results were empty).")
-        return {}
+    run_config = RunConfig(max_workers=max(1, concurrency)) if concurrency else RunConfig()
+
+    # --id mode: score the lone row through the metrics' single-turn API and
+    # skip building an Arrow-backed Dataset for evaluate().
+    if _use_new_api is True and len(used_ids) == 1:
+        from ragas.dataset_schema import SingleTurnSample
+
+        print("\n[Ragas] Evaluating 1 test case…")
+        sample = SingleTurnSample(
+            user_input=rows["question"][0],
+            retrieved_contexts=rows["contexts"][0],
+            reference=rows["reference"][0],
+        )
+        scores: Dict[str, Optional[float]] = {}
+        for key, metric in (
+            ("context_precision", _LLMContextPrecisionWithReference(llm=ragas_llm)),  # type: ignore[name-defined]
+            ("context_recall", _LLMContextRecall(llm=ragas_llm)),                     # type: ignore[name-defined]
+        ):
+            metric.init(run_config)
+            try:
+                v = float(metric.single_turn_score(sample))
+                scores[key] = round(v, 3) if v == v else None  # NaN check
+            except Exception as e:
+                print(f"[WARN] Ragas {key} failed: {e}")
+                scores[key] = None
+        evaluated = int(scores["context_precision"] is not None)
+        return {
+            "per_case": {used_ids[0]: scores},
+            "aggregate": {
+                "mean_context_precision": scores["context_precision"],
+                "mean_context_recall": scores["context_recall"],
+                "evaluated": evaluated,
+                "timed_out": 1 - evaluated,
+            },
+        }
 
     dataset = Dataset.from_dict(rows)
 
@@ -246,31 +323,44 @@ def run_ragas(test_cases: List[dict], all_results: Dict[str, List[dict]]) -> Dic
                 _LLMContextPrecisionWithReference(llm=ragas_llm),  # type: ignore[name-defined]
                 _LLMContextRecall(llm=ragas_llm),                  # type: ignore[name-defined]
             ]
-            score = evaluate(dataset, metrics=metrics_list, raise_exceptions=False)
+            score = evaluate(
+                dataset, metrics=metrics_list, raise_exceptions=False, run_config=run_config,
+            )
         elif _use_new_api == "collections":
             metrics_list = [
                 ContextPrecision(llm=ragas_llm),  # type: ignore[name-defined,call-arg]
                 ContextRecall(llm=ragas_llm),     # type: ignore[name-defined,call-arg]
             ]
-            score = evaluate(dataset, metrics=metrics_list, raise_exceptions=False)
+            score = evaluate(
+                dataset, metrics=metrics_list, raise_exceptions=False, run_config=run_config,
+            )
         else:
             score = evaluate(
                 dataset,
                 metrics=[context_precision, context_recall],  # type: ignore[name-defined]
                 llm=ragas_llm,
                 raise_exceptions=False,
+                run_config=run_config,
             )
     except Exception as e:
         print(f"[ERROR] Ragas evaluation failed: {e}")
         return {}
 
+    import numpy as np
+    import pandas as pd
+
     df = score.to_pandas()
-    def _safe(val: Any) -> Optional[float]:
-        try:
-            v = float(val)
-            return round(v, 3) if v == v else None  # NaN check
-        except (TypeError, ValueError):
-            return None
+
+    # Keep the full per-row frame for post-hoc slicing (card types, per-flow
+    # precision) without re-running the judge. pyarrow ships with datasets.
+    df_path: Optional[Path] = Path(__file__).parent / time.strftime(
+        "ragas_%Y%m%dT%H%M%SZ.parquet", time.gmtime()
+    )
+    try:
+        df.to_parquet(df_path, compression="zstd")
+    except Exception as e:
+        print(f"[WARN] Could not save Ragas dataframe: {e}")
+        df_path = None
 
     # Column names differ between Ragas versions
     cp_col = next(
@@ -280,24 +370,40 @@ def run_ragas(test_cases: List[dict], all_results: Dict[str, List[dict]]) -> Dic
         (c for c in df.columns if "recall" in c.lower()), "context_recall"
     )
 
-    per_case: Dict[str, Any] = {}
-    for i, tc_id in enumerate(used_ids):
-        row = df.iloc[i]
-        per_case[tc_id] = {
-            "context_precision": _safe(row.get(cp_col)),
-            "context_recall": _safe(row.get(cr_col)),
+    def _column(name: str) -> "np.ndarray":
+        """Score column as a float array; missing/non-numeric entries become NaN."""
+        if name not in df.columns:
+            return np.full(len(df), np.nan)
+        return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+    def _safe(v: float) -> Optional[float]:
+        return None if np.isnan(v) else round(float(v), 3)
+
+    cp_arr = _column(cp_col)
+    cr_arr = _column(cr_col)
+
+    per_case: Dict[str, Any] = {
+        tc_id: {
+            "context_precision": _safe(cp_arr[i]),
+            "context_recall": _safe(cr_arr[i]),
         }
+        for i, tc_id in enumerate(used_ids)
+    }
 
-    cp_vals = [v for v in df[cp_col].tolist() if v == v]  # filter NaN
-    cr_vals = [v for v in df[cr_col].tolist() if v == v]
+    cp_vals = cp_arr[~np.isnan(cp_arr)]
+    cr_vals = cr_arr[~np.isnan(cr_arr)]
     aggregate = {
-        "mean_context_precision": round(sum(cp_vals) / len(cp_vals), 3) if cp_vals else None,
-        "mean_context_recall": round(sum(cr_vals) / len(cr_vals), 3) if cr_vals else None,
-        "evaluated": len(cp_vals),
-        "timed_out": len(used_ids) - len(cp_vals),
+        "mean_context_precision": round(float(cp_vals.mean()), 3) if cp_vals.size else None,
+        "mean_context_recall": round(float(cr_vals.mean()), 3) if cr_vals.size else None,
+        "evaluated": int(cp_vals.size),
+        "timed_out": len(used_ids) - int(cp_vals.size),
     }
 
-    return {"per_case": per_case, "aggregate": aggregate}
+    return {
+        "per_case": per_case,
+        "aggregate": aggregate,
+        "dataframe_path": str(df_path) if df_path else None,
+    }
 
 
 # ─── Reporting ─────────────────────────────────────────────────────────────────
@@ -330,13 +436,28 @@ def print_case(tc: dict, det: dict, ragas_scores: Optional[dict] = None) -> None
             print(f"  Ctx Rec   {'─' * 20} n/a (timeout/quota)")
 
 
-def print_summary(all_det: List[dict], ragas_agg: Optional[dict] = None) -> None:
+def deterministic_means(all_det: List[dict]) -> Tuple[float, float, float]:
+    """Mean (flow hit rate, file hit rate, precision@k) in a single pass."""
+    n = len(all_det)
+    if n == 0:
+        return 0.0, 0.0, 0.0
+    s_fhr = s_fir = s_p = 0.0
+    for d in all_det:
+        s_fhr += d["flow_hit_rate"]
+        s_fir += d["file_hit_rate"]
+        s_p += d["precision_at_k"]
+    return s_fhr / n, s_fir / n, s_p / n
+
+
+def print_summary(
+    all_det: List[dict],
+    ragas_agg: Optional[dict] = None,
+    means: Optional[Tuple[float, float, float]] = None,
+) -> None:
     n = len(all_det)
     if n == 0:
         return
-    mean_fhr = sum(d["flow_hit_rate"] for d in all_det) / n
-    mean_fir = sum(d["file_hit_rate"] for d in all_det) / n
-    mean_p   = sum(d["precision_at_k"] for d in all_det) / n
+    mean_fhr, mean_fir, mean_p = means or deterministic_means(all_det)
 
     print("\n" + "=" * 60)
     print("  SUMMARY")
@@ -364,18 +485,25 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Evaluate codeprism search quality.")
     parser.add_argument("--server", default=CODEPRISM_DEFAULT, help="codeprism base URL")
     parser.add_argument("--ragas", action="store_true", help="Run Ragas LLM metrics (needs API key)")
+    parser.add_argument("--ragas-concurrency", type=int, default=None, help="Max parallel Ragas judge calls (default: Ragas' own)")
     parser.add_argument("--id", dest="case_id", default=None, help="Run a single test case by id")
     parser.add_argument("--limit", type=int, default=SEARCH_LIMIT, help="Number of results to fetch per query")
+    parser.add_argument("--concurrency", type=int, default=SEARCH_CONCURRENCY, help="Max parallel search requests")
     parser.add_argument("--verbose", action="store_true", help="Print raw search results")
+    parser.add_argument("--search-cache", action="store_true", help="Reuse /api/search results cached within 24h for the same index")
+    parser.add_argument("--no-judge-cache", action="store_true", help="Bypass the on-disk Ragas judge cache")
     args = parser.parse_args()
 
     # Load dataset
-    with open(DATASET_PATH) as f:
-        dataset = json.load(f)
+    dataset = load_json(DATASET_PATH)
     test_cases = dataset["test_cases"]
+    for tc in test_cases:
+        normalize_test_case(tc)
 
     if args.case_id:
-        test_cases = [tc for tc in test_cases if tc["id"] == args.case_id]
+        by_id = {tc["id"]: tc for tc in test_cases}
+        tc = by_id.get(args.case_id)
+        test_cases = [tc] if tc else []
         if not test_cases:
             print(f"[ERROR] No test case with id '{args.case_id}'")
             sys.exit(1)
@@ -387,47 +515,83 @@ def main() -> None:
     else:
         print(f"[codeprism] server at {args.server} (health check failed – proceeding anyway)")
 
+    if args.search_cache:
+        if health:
+            open_search_cache(index_fingerprint(health))
+        else:
+            print("[WARN] --search-cache ignored: no index fingerprint without a health check")
+
     print(f"\nRunning {len(test_cases)} test case(s)…\n")
     print("=" * 60)
 
     all_det: List[dict] = []
     all_results: Dict[str, List[dict]] = {}
 
+    # Test cases sharing a query are searched once and fanned out afterwards.
+    unique: Dict[tuple, List[dict]] = {}
     for tc in test_cases:
-        print(f"  → {tc['id']} : {tc['query'][:60]}…")
-        results = search(args.server, tc["query"], args.limit)
-        all_results[tc["id"]] = results
-
-        if args.verbose:
-            for r in results:
-                print(f"      [{r['score']:.3f}] {r['flow']} / {r['title']} ({r['card_type']})")
-                for sf in r.get("source_files", [])[:3]:
-                    print(f"            {sf}")
+        unique.setdefault((tc["query"], args.limit), []).append(tc)
+
+    # Searches are I/O-bound: fan them out over a thread pool. max_workers
+    # bounds how hard we hit the server (replaces the old per-query sleep).
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = {
+            pool.submit(search, args.server, query, limit): (query, limit)
+            for query, limit in unique
+        }
+        try:
+            for fut in as_completed(futures):
+                results = fut.result()
+                for tc in unique[futures[fut]]:
+                    all_results[tc["id"]] = results
+                    print(f"  → {tc['id']} : {tc['query'][:60]}…")
+
+                if args.verbose:
+                    for r in results:
+                        print(f"      [{r['score']:.3f}] {r['flow']} / {r['title']} ({r['card_type']})")
+                        for sf in r.get("source_files", [])[:3]:
+                            print(f"            {sf}")
+        except CodeprismError as e:
+            # Drop the queued searches; only the in-flight ones are waited on.
+            pool.shutdown(cancel_futures=True)
+            print(f"\n{e}")
+            sys.exit(1)
 
-        time.sleep(0.1)  # be polite
+    # Deterministic metrics (CPU-bound; spread over processes for big datasets)
+    case_results = [all_results.get(tc["id"], []) for tc in test_cases]
+    if len(test_cases) > PARALLEL_DET_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+            det_list = list(pool.map(compute_deterministic, test_cases, case_results, chunksize=32))
+    else:
+        det_list = [compute_deterministic(tc, res) for tc, res in zip(test_cases, case_results)]
 
-    # Deterministic metrics
     det_by_id: Dict[str, dict] = {}
-    for tc in test_cases:
-        det = compute_deterministic(tc, all_results.get(tc["id"], []))
+    for tc, det in zip(test_cases, det_list):
         det_by_id[tc["id"]] = det
         all_det.append(det)
 
     # Ragas metrics
     ragas_by_id: Dict[str, Any] = {}
     ragas_agg: Optional[dict] = None
+    ragas_df_path: Optional[str] = None
     if args.ragas:
-        ragas_out = run_ragas(test_cases, all_results)
+        ragas_out = run_ragas(
+            test_cases, all_results,
+            use_cache=not args.no_judge_cache,
+            concurrency=args.ragas_concurrency,
+        )
         if ragas_out:
             ragas_by_id = ragas_out.get("per_case", {})
             ragas_agg = ragas_out.get("aggregate")
+            ragas_df_path = ragas_out.get("dataframe_path")
 
     # Print per-case report
     for tc in test_cases:
         print_case(tc, det_by_id[tc["id"]], ragas_by_id.get(tc["id"]))
 
     # Print summary
-    print_summary(all_det, ragas_agg)
+    means = deterministic_means(all_det)
+    print_summary(all_det, ragas_agg, means)
 
     # Save results JSON
     output = {
@@ -455,15 +619,15 @@ def main() -> None:
             for tc in test_cases
         ],
         "aggregate_deterministic": {
-            "mean_flow_hit_rate": round(sum(d["flow_hit_rate"] for d in all_det) / len(all_det), 3) if all_det else 0,
-            "mean_file_hit_rate": round(sum(d["file_hit_rate"] for d in all_det) / len(all_det), 3) if all_det else 0,
-            "mean_precision_at_k": round(sum(d["precision_at_k"] for d in all_det) / len(all_det), 3) if all_det else 0,
+            "mean_flow_hit_rate": round(means[0], 3) if all_det else 0,
+            "mean_file_hit_rate": round(means[1], 3) if all_det else 0,
+            "mean_precision_at_k": round(means[2], 3) if all_det else 0,
         },
         "aggregate_ragas": ragas_agg,
+        "ragas_dataframe": ragas_df_path,
     }
 
-    with open(RESULTS_PATH, "w") as f:
-        json.dump(output, f, indent=2)
+    dump_json(RESULTS_PATH, output)
 
     print(f"\n  Results saved → {RESULTS_PATH}\n")
 
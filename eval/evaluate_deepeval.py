@@ -21,29 +21,44 @@ Requirements:
 """
 
 import argparse
-import json
-import os
+import hashlib
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-import requests
+from eval_common import (
+    SEARCH_LIMIT,
+    cached_search,
+    dump_json,
+    dumps_json,
+    index_fingerprint,
+    load_json,
+    make_session,
+    open_search_cache,
+)
 
 SCRIPT_DIR = Path(__file__).parent
 GOLDEN_PATH = SCRIPT_DIR / "golden_dataset.json"
-HISTORY_PATH = SCRIPT_DIR / "history.json"
+HISTORY_PATH = SCRIPT_DIR / "history.jsonl"
 RESULTS_PATH = SCRIPT_DIR / "deepeval_results.json"
+JUDGE_CACHE_DIR = SCRIPT_DIR / ".judge_cache"
+SEARCH_CONCURRENCY = 8
+RETRIEVAL_CONTEXT_K = 10  # cards passed to the judge per test case
 
 
 # ---------------------------------------------------------------------------
 # codeprism search helper
 # ---------------------------------------------------------------------------
 
-def search_codeprism(server: str, query: str, limit: int = 10) -> list[dict]:
+SESSION = make_session()
+
+
+@cached_search
+def search_codeprism(server: str, query: str, limit: int = SEARCH_LIMIT) -> list[dict]:
     """Call codeprism hybrid search and return the raw card list."""
     try:
-        resp = requests.get(
+        resp = SESSION.get(
             f"{server}/api/search",
             params={"q": query, "limit": limit},
             timeout=30,
@@ -60,31 +75,56 @@ def search_codeprism(server: str, query: str, limit: int = 10) -> list[dict]:
 # Build DeepEval test cases from golden dataset
 # ---------------------------------------------------------------------------
 
-def build_test_cases(server: str, golden: list[dict], ids: list[str] | None = None):
+def build_test_cases(
+    server: str,
+    golden: list[dict],
+    ids: list[str] | None = None,
+    concurrency: int = SEARCH_CONCURRENCY,
+):
     """
     For each golden entry, call codeprism and build a DeepEvalTestCase.
+    Searches run concurrently (bounded by `concurrency`), once per distinct
+    query; test cases are built afterwards in dataset order.
     Returns list of (test_case, expected_flows) tuples.
     """
+    ids_set = set(ids) if ids else None
+    entries = [entry for entry in golden if not ids_set or entry["id"] in ids_set]
+
+    def _query(entry: dict) -> str:
+        return entry.get("query", entry.get("description", ""))
+
+    def _search(query: str) -> list[dict]:
+        print(f"  Searching: {query[:60]}...")
+        return search_codeprism(server, query)
+
+    # Entries sharing a query are searched once.
+    unique_queries = list(dict.fromkeys(_query(entry) for entry in entries))
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        cards_by_query = dict(zip(unique_queries, pool.map(_search, unique_queries)))
+
+    # Nothing came back: fail fast without paying for the deepeval import.
+    if not any(cards_by_query.values()):
+        return []
     from deepeval.test_case import LLMTestCase
 
-    cases = []
-    for entry in golden:
-        if ids and entry["id"] not in ids:
-            continue
+    # Newer deepeval renamed additional_metadata to metadata (the old name warns).
+    meta_field = "metadata" if "metadata" in getattr(LLMTestCase, "model_fields", {}) else "additional_metadata"
 
-        query = entry.get("query", entry.get("description", ""))
+    cases = []
+    for entry in entries:
+        query = _query(entry)
+        cards = cards_by_query[query]
         expected_flows: list[str] = entry.get("expected_flows", [])
         ground_truth = entry.get("ground_truth", " ".join(expected_flows))
 
-        print(f"  Searching: {query[:60]}...")
-        cards = search_codeprism(server, query)
         if not cards:
             print(f"  [skip] no results for {entry['id']}")
             continue
 
-        # Format retrieved contexts as strings (card title + content excerpt)
+        # Format retrieved contexts as strings (card title + content excerpt).
+        # Cards past rank K never reach the judge, so don't format them.
         retrieval_context = []
-        for card in cards:
+        for card in cards[:RETRIEVAL_CONTEXT_K]:
             title = card.get("title", "")
             content = card.get("content", "")[:400]
             card_type = card.get("card_type", "")
@@ -94,12 +134,14 @@ def build_test_cases(server: str, golden: list[dict], ids: list[str] | None = No
             input=query,
             actual_output="\n\n".join(retrieval_context[:3]),  # top-3 as "answer"
             expected_output=ground_truth,
+            # Both metrics read retrieval_context only; also setting `context`
+            # would just duplicate the payload.
             retrieval_context=retrieval_context,
-            context=retrieval_context,
             name=entry["id"],
+            # Hashed once here so every metric's cache lookup can share it.
+            **{meta_field: {"cache_key": test_case_key(query, ground_truth, retrieval_context)}},
         )
         cases.append((tc, expected_flows, cards))
-        time.sleep(0.2)  # be gentle with codeprism
 
     return cases
 
@@ -108,7 +150,79 @@ def build_test_cases(server: str, golden: list[dict], ids: list[str] | None = No
 # Metric computation
 # ---------------------------------------------------------------------------
 
-def run_metrics(test_cases_data: list, model_name: str | None) -> list[dict]:
+# Metric attributes restored on a judge-cache hit (whichever the metric has).
+_METRIC_STATE = ("score", "reason", "verdicts", "verdicts_list")
+
+
+def open_judge_cache():
+    """Return the on-disk judge cache, or None when diskcache isn't installed."""
+    try:
+        from diskcache import Cache
+    except ImportError:
+        return None
+    return Cache(str(JUDGE_CACHE_DIR))
+
+
+def test_case_key(query: str, expected_output: str | None, retrieval_context: list[str]) -> str:
+    """Stable digest of everything a judge sees for one test case."""
+    payload = "\x1f".join([query, expected_output or "", *retrieval_context])
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+# Metric settings that change what the judge is asked or how it is scored.
+_METRIC_CONFIG = ("threshold", "include_reason", "strict_mode", "eval_mode")
+
+
+def metric_key(metric) -> str:
+    """
+    Identify a metric and the judge it resolved to. DeepEval picks the judge
+    from --model or its env/config (OpenAI, Gemini, `deepeval set-ollama`),
+    so key on the model class + name it actually uses, not the CLI flag.
+    """
+    model = getattr(metric, "model", None)
+    template = getattr(metric, "evaluation_template", None)
+    parts = [
+        type(metric).__name__,
+        type(model).__name__ if model is not None else "",
+        str(getattr(metric, "evaluation_model", "")),
+        getattr(template, "__name__", ""),
+        *(f"{a}={getattr(metric, a, None)}" for a in _METRIC_CONFIG),
+    ]
+    return "|".join(parts)
+
+
+def measure_cached(metric, tc, cache) -> None:
+    """
+    metric.measure(tc), reusing a stored judge result for identical inputs
+    scored by the same judge and metric settings. Only successful
+    measurements (score is not None) are cached.
+    """
+    if cache is None:
+        metric.measure(tc)
+        return
+
+    metadata = tc.metadata if hasattr(tc, "metadata") else tc.additional_metadata
+    tc_key = (metadata or {}).get("cache_key") or test_case_key(
+        tc.input, tc.expected_output, tc.retrieval_context
+    )
+    key = f"{metric_key(metric)}|{tc_key}"
+
+    hit = cache.get(key)
+    if hit is not None:
+        for attr, value in hit.items():
+            setattr(metric, attr, value)
+        return
+
+    metric.measure(tc)
+    if metric.score is not None:
+        cache.set(key, {a: getattr(metric, a) for a in _METRIC_STATE if hasattr(metric, a)})
+
+
+def run_metrics(
+    test_cases_data: list,
+    model_name: str | None,
+    use_cache: bool = True,
+) -> list[dict]:
     """Run DeepEval metrics and return per-case results."""
     try:
         from deepeval.metrics import (
@@ -127,6 +241,7 @@ def run_metrics(test_cases_data: list, model_name: str | None) -> list[dict]:
 
     precision_metric = ContextualPrecisionMetric(threshold=0.5, **judge_kwargs)
     relevancy_metric = ContextualRelevancyMetric(threshold=0.5, **judge_kwargs)
+    judge_cache = open_judge_cache() if use_cache else None
 
     results = []
     for tc, expected_flows, cards in test_cases_data:
@@ -153,20 +268,20 @@ def run_metrics(test_cases_data: list, model_name: str | None) -> list[dict]:
         # Card type breakdown
         type_counts: dict[str, int] = {}
         for c in cards:
-            ct = c.get("card_type", "unknown")
+            ct = c.get("card_type") or "unknown"
             type_counts[ct] = type_counts.get(ct, 0) + 1
         case_result["card_type_breakdown"] = type_counts
 
         # Run metrics (may require LLM calls)
         try:
-            precision_metric.measure(tc)
+            measure_cached(precision_metric, tc, judge_cache)
             case_result["contextual_precision"] = precision_metric.score
             print(f"    Contextual Precision: {precision_metric.score:.3f}")
         except Exception as e:
             print(f"    [warn] ContextualPrecision failed: {e}")
 
         try:
-            relevancy_metric.measure(tc)
+            measure_cached(relevancy_metric, tc, judge_cache)
             case_result["contextual_relevancy"] = relevancy_metric.score
             print(f"    Contextual Relevancy: {relevancy_metric.score:.3f}")
 
@@ -218,21 +333,15 @@ def aggregate(results: list[dict]) -> dict:
 
 
 def append_to_history(aggregate_scores: dict, git_sha: str | None) -> None:
-    history: list[dict] = []
-    if HISTORY_PATH.exists():
-        try:
-            history = json.loads(HISTORY_PATH.read_text())
-        except Exception:
-            pass
-
-    history.append({
+    """Append one JSON line to the history ledger (no read/rewrite of past runs)."""
+    entry = {
         "timestamp": datetime.utcnow().isoformat() + "Z",
         "git_sha": git_sha,
         "tool": "deepeval",
         **aggregate_scores,
-    })
-
-    HISTORY_PATH.write_text(json.dumps(history, indent=2))
+    }
+    with open(HISTORY_PATH, "ab") as f:
+        f.write(dumps_json(entry) + b"\n")
     print(f"\n  History updated: {HISTORY_PATH}")
 
 
@@ -260,36 +369,44 @@ def main():
     parser.add_argument("--server", default="http://localhost:4000", help="codeprism server URL")
     parser.add_argument("--model", default=None, help="Judge model (e.g. ollama/qwen2.5:7b)")
     parser.add_argument("--id", dest="ids", action="append", help="Run specific test case IDs")
-    parser.add_argument("--no-history", action="store_true", help="Skip appending to history.json")
+    parser.add_argument("--concurrency", type=int, default=SEARCH_CONCURRENCY, help="Max parallel search requests")
+    parser.add_argument("--no-history", action="store_true", help="Skip appending to history.jsonl")
+    parser.add_argument("--search-cache", action="store_true", help="Reuse /api/search results cached within 24h for the same index")
+    parser.add_argument("--no-judge-cache", action="store_true", help="Bypass the on-disk DeepEval judge cache")
     args = parser.parse_args()
 
     # Check codeprism is running
     try:
-        requests.get(f"{args.server}/api/health", timeout=5).raise_for_status()
+        resp = SESSION.get(f"{args.server}/api/health", timeout=5)
+        resp.raise_for_status()
+        health = resp.json()
     except Exception:
         print(f"\n  ✗  codeprism is not running at {args.server}")
         print(f"     Start it first: cd {SCRIPT_DIR.parent} && pnpm dev\n")
         sys.exit(1)
 
+    if args.search_cache:
+        open_search_cache(index_fingerprint(health))
+
     # Load golden dataset
     if not GOLDEN_PATH.exists():
         print(f"[error] Golden dataset not found at {GOLDEN_PATH}")
         sys.exit(1)
 
-    golden = json.loads(GOLDEN_PATH.read_text())
+    golden = load_json(GOLDEN_PATH)
     print(f"\n  codeprism DeepEval Evaluation")
     print(f"  Server : {args.server}")
     print(f"  Judge  : {args.model or 'default (requires API key)'}")
     print(f"  Cases  : {len(golden)} in dataset\n")
 
     # Build test cases
-    test_cases_data = build_test_cases(args.server, golden, args.ids)
+    test_cases_data = build_test_cases(args.server, golden, args.ids, args.concurrency)
     if not test_cases_data:
         print("[error] No test cases could be built (check codeprism is running and has cards)")
         sys.exit(1)
 
     # Run metrics
-    results = run_metrics(test_cases_data, args.model)
+    results = run_metrics(test_cases_data, args.model, use_cache=not args.no_judge_cache)
 
     # Save per-case results
     output = {
@@ -299,7 +416,7 @@ def main():
         "cases": results,
         "aggregate": aggregate(results),
     }
-    RESULTS_PATH.write_text(json.dumps(output, indent=2))
+    dump_json(RESULTS_PATH, output)
     print(f"\n  Results saved: {RESULTS_PATH}")
 
     # Print summary
@@ -10,158 +10,317 @@ Usage:
     python generate_benchmarks.py --server http://my-codeprism:4000
     python generate_benchmarks.py --project mastodon --repo mastodon/mastodon --lang Ruby --framework Rails
     python generate_benchmarks.py --append  # merge into existing benchmarks.json
+    python generate_benchmarks.py --qps 5   # throttle queries against a shared server
+
+Queries run one at a time by default so latency_ms is not inflated by queueing
+on the server. --concurrency N speeds up the run; the level used is recorded as
+latency_concurrency on each project, and latencies are only comparable between
+runs at the same level.
 
 Output:
     benchmarks.json in the same directory.
 """
 
 import argparse
-import json
-import statistics
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional
 
+import numpy as np
 import requests
 
+from eval_common import (
+    SEARCH_LIMIT,
+    dump_json,
+    load_json,
+    make_session,
+    normalize_test_case,
+    response_json,
+)
+
+try:
+    import ahocorasick
+except ImportError:  # per-fragment substring scan fallback
+    ahocorasick = None  # type: ignore[assignment]
+
 CODEPRISM_DEFAULT = "http://localhost:4000"
 DATASET_PATH = Path(__file__).parent / "golden_dataset.json"
 OUTPUT_PATH = Path(__file__).parent / "benchmarks.json"
-SEARCH_LIMIT = 10
+# latency_ms is timed per request, so parallel queries would also measure
+# queueing behind each other on the server. Serial by default keeps published
+# latencies comparable across runs; the value used is recorded per project.
+SEARCH_CONCURRENCY = 1
+
+# No HTTP-level retries: a retried query would fold backoff time into latency_ms.
+SESSION = make_session(retry=False)
+
 
+def load_test_cases(path: Path) -> list:
+    """
+    Load the dataset's test_cases. With ijson installed, items are streamed
+    straight out of the file instead of materializing the whole document first.
+    """
+    try:
+        import ijson
+    except ImportError:
+        return load_json(path)["test_cases"]
+    with open(path, "rb") as f:
+        return list(ijson.items(f, "test_cases.item", use_float=True))
 
-def search_with_timing(server: str, query: str, limit: int = SEARCH_LIMIT) -> dict:
+
+class RateLimiter:
+    """
+    Thread-safe pacing for --qps: wait() blocks just long enough that calls
+    start no closer together than 1/qps seconds. Workers only sleep when they
+    would otherwise exceed the rate.
+    """
+
+    def __init__(self, qps: float) -> None:
+        self.interval = 1.0 / qps
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def search_with_timing(
+    session: requests.Session,
+    server: str,
+    query: str,
+    limit: int = SEARCH_LIMIT,
+    limiter: Optional[RateLimiter] = None,
+) -> dict:
     """Call GET /api/search, return results + timing info."""
     url = f"{server}/api/search"
-    start = time.monotonic()
+    if limiter is not None:
+        limiter.wait()  # throttling time is not counted as latency
+    start = time.perf_counter()
     try:
-        resp = requests.get(url, params={"q": query, "limit": limit}, timeout=30)
+        resp = session.get(url, params={"q": query, "limit": limit}, timeout=30)
         resp.raise_for_status()
-        elapsed_ms = round((time.monotonic() - start) * 1000)
-        data = resp.json()
+        elapsed_ms = round((time.perf_counter() - start) * 1000)
+        data = response_json(resp)
         return {
             "results": data.get("results", []),
             "latency_ms": elapsed_ms,
             "cache_hit": data.get("cacheHit", False),
         }
     except Exception as e:
-        elapsed_ms = round((time.monotonic() - start) * 1000)
+        elapsed_ms = round((time.perf_counter() - start) * 1000)
         print(f"  [WARN] Query failed: {e}")
         return {"results": [], "latency_ms": elapsed_ms, "cache_hit": False}
 
 
-def estimate_naive_tokens(results: List[dict]) -> int:
-    """
-    Estimate how many tokens an AI would read WITHOUT codeprism.
-    Each unique source file averages ~500 tokens (conservative).
-    """
-    all_files = set()
-    for r in results:
-        for sf in r.get("source_files", []):
-            all_files.add(sf)
-    return len(all_files) * 500
+def prepare_test_case(test_case: dict) -> None:
+    """normalize_test_case, plus the fragment automaton used by analyze_results."""
+    normalize_test_case(test_case)
+    test_case["_expected_files_ac"] = _fragment_automaton(test_case["_expected_files_lc"])
 
 
-def estimate_codeprism_tokens(results: List[dict]) -> int:
-    """Estimate tokens in codeprism's response (card content)."""
-    total = 0
-    for r in results:
-        content = r.get("content", "")
-        total += len(content) // 4
-    return max(total, 1)
-
+def _fragment_automaton(fragments: tuple) -> Optional[Any]:
+    """
+    Aho–Corasick automaton over the expected file fragments, so each source
+    path is scanned once for all of them. None without pyahocorasick (or when
+    there is nothing to match), in which case callers do plain substring tests.
+    """
+    if ahocorasick is None or not fragments or not all(fragments):
+        return None
+    automaton = ahocorasick.Automaton()
+    for f in fragments:
+        automaton.add_word(f, f)
+    automaton.make_automaton()
+    return automaton
 
-def compute_accuracy(test_case: dict, results: List[dict]) -> dict:
-    expected_flows = set(f.lower() for f in test_case.get("expected_flows", []))
-    expected_files = [f.lower() for f in test_case.get("expected_file_fragments", [])]
 
-    result_flows = set()
-    all_source_files: List[str] = []
+@dataclass(frozen=True, slots=True)
+class CaseAnalysis:
+    """
+    Scores for one query's results.
+      - codeprism_tokens: tokens in codeprism's response (card content, ~4 chars/token)
+      - naive_tokens: tokens an AI would read WITHOUT codeprism; each unique
+        source file averages ~500 tokens (conservative)
+    """
+    codeprism_tokens: int
+    naive_tokens: int
+    flow_hit_rate: float
+    file_hit_rate: float
+    precision_at_k: float
+
+
+def analyze_results(test_case: dict, results: List[dict]) -> CaseAnalysis:
+    """Score one query's results in a single pass over them."""
+    if "_expected_flows_lc" not in test_case:
+        prepare_test_case(test_case)
+    expected_flows = test_case["_expected_flows_lc"]
+    expected_files = test_case["_expected_files_lc"]
+
+    # Per-flow result counts double as the result flow set
+    flow_counts: Counter = Counter()
+    unique_files = set()
+    codeprism_tokens = 0
     for r in results:
-        flow = (r.get("flow") or "").lower()
-        result_flows.add(flow)
-        for sf in r.get("source_files", []):
-            all_source_files.append(sf.lower())
+        flow_counts[(r.get("flow") or "").lower()] += 1
+        codeprism_tokens += len(r.get("content", "")) // 4
+        unique_files.update(r.get("source_files", []))
 
-    found_flows = expected_flows & result_flows
+    found_flows = expected_flows & flow_counts.keys()
     flow_hit_rate = len(found_flows) / len(expected_flows) if expected_flows else 1.0
 
-    all_files_combined = " ".join(all_source_files)
-    found_file_frags = [f for f in expected_files if f in all_files_combined]
-    file_hit_rate = len(found_file_frags) / len(expected_files) if expected_files else 1.0
+    # Lowercased paths are only needed to match fragments; skip them otherwise.
+    if expected_files:
+        all_source_files = [sf.lower() for sf in unique_files]
+        automaton = test_case.get("_expected_files_ac")
+        if automaton is not None:
+            matched = {frag for sf in all_source_files for _, frag in automaton.iter(sf)}
+            found_file_frags = [f for f in expected_files if f in matched]
+        else:
+            found_file_frags = [f for f in expected_files if any(f in sf for sf in all_source_files)]
+        file_hit_rate = len(found_file_frags) / len(expected_files)
+    else:
+        file_hit_rate = 1.0
 
     k = len(results)
-    relevant = sum(1 for r in results if (r.get("flow") or "").lower() in expected_flows)
+    relevant = sum(flow_counts[f] for f in expected_flows)
     precision_at_k = relevant / k if k > 0 else 0.0
 
-    return {
-        "flow_hit_rate": round(flow_hit_rate, 3),
-        "file_hit_rate": round(file_hit_rate, 3),
-        "precision_at_k": round(precision_at_k, 3),
-    }
-
-
-def run_benchmarks(server: str, test_cases: list, limit: int) -> tuple:
-    """Run benchmark queries and return (cases, latencies, cache_hits)."""
-    cases: list = []
-    latencies: list = []
-    cache_hits = 0
+    return CaseAnalysis(
+        codeprism_tokens=max(codeprism_tokens, 1),
+        naive_tokens=len(unique_files) * 500,
+        flow_hit_rate=round(flow_hit_rate, 3),
+        file_hit_rate=round(file_hit_rate, 3),
+        precision_at_k=round(precision_at_k, 3),
+    )
+
+
+# Per-query benchmark columns, in the order they appear in benchmarks.json.
+# run_benchmarks fills one pre-allocated array per field (struct-of-arrays);
+# per-case dicts are only materialized for serialization.
+CASE_FIELDS = (
+    ("query", object),
+    ("ticket", object),
+    ("codeprism_tokens", np.int64),
+    ("naive_tokens", np.int64),
+    ("latency_ms", np.int64),
+    ("cache_hit", np.bool_),
+    ("flow_hit_rate", np.float64),
+    ("file_hit_rate", np.float64),
+    ("precision_at_k", np.float64),
+    ("result_count", np.int64),
+)
+
+
+def run_benchmarks(
+    server: str,
+    test_cases: list,
+    limit: int,
+    concurrency: int = SEARCH_CONCURRENCY,
+    qps: Optional[float] = None,
+) -> Dict[str, np.ndarray]:
+    """Run benchmark queries and return one column per CASE_FIELDS entry."""
+    n = len(test_cases)
+    cols = {name: np.empty(n, dtype=dtype) for name, dtype in CASE_FIELDS}
+    limiter = RateLimiter(qps) if qps else None
+
+    # Queries are I/O-bound: dispatch them concurrently, but keep the
+    # responses in input order so cases line up with the dataset.
+    responses: List[Optional[dict]] = [None] * n
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(search_with_timing, SESSION, server, tc["query"], limit, limiter): i
+            for i, tc in enumerate(test_cases)
+        }
+        for fut in as_completed(futures):
+            i = futures[fut]
+            responses[i] = fut.result()
+            print(f"  → {test_cases[i]['id']}: {test_cases[i]['query'][:60]}...")
 
-    for tc in test_cases:
-        print(f"  → {tc['id']}: {tc['query'][:60]}...")
-        data = search_with_timing(server, tc["query"], limit)
+    for i, (tc, data) in enumerate(zip(test_cases, responses)):
         results = data["results"]
-        latency = data["latency_ms"]
-
-        codeprism_tokens = estimate_codeprism_tokens(results)
-        naive_tokens = estimate_naive_tokens(results)
-        accuracy = compute_accuracy(tc, results)
+        analysis = analyze_results(tc, results)
 
-        if data["cache_hit"]:
-            cache_hits += 1
-        latencies.append(latency)
+        cols["query"][i] = tc["query"]
+        cols["ticket"][i] = tc.get("ticket")
+        cols["codeprism_tokens"][i] = analysis.codeprism_tokens
+        cols["naive_tokens"][i] = analysis.naive_tokens
+        cols["latency_ms"][i] = data["latency_ms"]
+        cols["cache_hit"][i] = data["cache_hit"]
+        cols["flow_hit_rate"][i] = analysis.flow_hit_rate
+        cols["file_hit_rate"][i] = analysis.file_hit_rate
+        cols["precision_at_k"][i] = analysis.precision_at_k
+        cols["result_count"][i] = len(results)
 
-        cases.append({
-            "query": tc["query"],
-            "ticket": tc.get("ticket"),
-            "codeprism_tokens": codeprism_tokens,
-            "naive_tokens": naive_tokens,
-            "latency_ms": latency,
-            "cache_hit": data["cache_hit"],
-            "flow_hit_rate": accuracy["flow_hit_rate"],
-            "file_hit_rate": accuracy["file_hit_rate"],
-            "precision_at_k": accuracy["precision_at_k"],
-            "result_count": len(results),
-        })
+    return cols
 
-        time.sleep(0.05)
 
-    return cases, latencies, cache_hits
+def case_records(cols: Dict[str, np.ndarray]) -> List[dict]:
+    """Materialize the per-case dicts written to benchmarks.json."""
+    names = [name for name, _ in CASE_FIELDS]
+    return [dict(zip(names, row)) for row in zip(*(cols[name].tolist() for name in names))]
 
 
-def build_project_stats(cases: list, latencies: list, cache_hits: int) -> dict:
-    """Compute aggregate stats from individual query results."""
-    n = len(cases)
+def build_project_stats(cols: Dict[str, np.ndarray]) -> dict:
+    """Compute aggregate stats from the per-query columns."""
+    n = len(cols["query"])
     if n == 0:
         return {}
-    sorted_latencies = sorted(latencies)
-    avg_codeprism = round(sum(c["codeprism_tokens"] for c in cases) / n)
-    avg_naive = round(sum(c["naive_tokens"] for c in cases) / n)
+
+    latencies = cols["latency_ms"]
+    avg_codeprism = round(float(cols["codeprism_tokens"].mean()))
+    avg_naive = round(float(cols["naive_tokens"].mean()))
     token_reduction = round((1 - avg_codeprism / avg_naive) * 100, 1) if avg_naive > 0 else 0
 
+    # Same nearest-rank indices as a full sort would use, selected in O(n).
+    kth = [n // 2, int(n * 0.95), int(n * 0.99)]
+    p50, p95, p99 = (int(v) for v in np.partition(latencies, kth)[kth])
+
     return {
         "queries_tested": n,
         "avg_tokens_with_codeprism": avg_codeprism,
         "avg_tokens_without": avg_naive,
         "token_reduction_pct": token_reduction,
-        "avg_latency_ms": round(statistics.mean(latencies)),
-        "p50_latency_ms": sorted_latencies[n // 2],
-        "p95_latency_ms": sorted_latencies[int(n * 0.95)],
-        "p99_latency_ms": sorted_latencies[int(n * 0.99)],
-        "cache_hit_rate": round(cache_hits / n, 3),
-        "flow_hit_rate": round(sum(c["flow_hit_rate"] for c in cases) / n, 3),
-        "file_hit_rate": round(sum(c["file_hit_rate"] for c in cases) / n, 3),
-        "precision_at_5": round(sum(c["precision_at_k"] for c in cases) / n, 3),
+        "avg_latency_ms": round(float(latencies.mean())),
+        "p50_latency_ms": p50,
+        "p95_latency_ms": p95,
+        "p99_latency_ms": p99,
+        "cache_hit_rate": round(float(cols["cache_hit"].mean()), 3),
+        "flow_hit_rate": round(float(cols["flow_hit_rate"].mean()), 3),
+        "file_hit_rate": round(float(cols["file_hit_rate"].mean()), 3),
+        "precision_at_5": round(float(cols["precision_at_k"].mean()), 3),
+    }
+
+
+def build_aggregate(projects: List[dict]) -> dict:
+    """Cross-project averages, accumulated in one pass over the projects."""
+    k = total_queries = 0
+    tot_tok = tot_lat = tot_flow = tot_cache = 0.0
+    for p in projects:
+        s = p.get("stats")
+        if not s:
+            continue
+        k += 1
+        total_queries += s.get("queries_tested", 0)
+        tot_tok += s.get("token_reduction_pct", 0)
+        tot_lat += s.get("avg_latency_ms", 0)
+        tot_flow += s.get("flow_hit_rate", 0)
+        tot_cache += s.get("cache_hit_rate", 0)
+
+    return {
+        "total_projects": len(projects),
+        "total_queries": total_queries,
+        "avg_token_reduction_pct": round(tot_tok / k, 1) if k else 0,
+        "avg_latency_ms": round(tot_lat / k) if k else 0,
+        "avg_flow_hit_rate": round(tot_flow / k, 3) if k else 0,
+        "avg_cache_hit_rate": round(tot_cache / k, 3) if k else 0,
     }
 
 
@@ -173,61 +332,46 @@ def main() -> None:
     parser.add_argument("--lang", default=None, help="Primary language")
     parser.add_argument("--framework", default=None, help="Framework name")
     parser.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    parser.add_argument("--concurrency", type=int, default=SEARCH_CONCURRENCY, help="Max parallel queries (default: %(default)s; >1 inflates latency_ms)")
+    parser.add_argument("--qps", type=float, default=None, help="Cap query rate (queries/second); unthrottled by default")
     parser.add_argument("--append", action="store_true", help="Append to existing benchmarks.json")
     args = parser.parse_args()
 
-    with open(DATASET_PATH) as f:
-        dataset = json.load(f)
-    test_cases = dataset["test_cases"]
+    test_cases = load_test_cases(DATASET_PATH)
+    for tc in test_cases:
+        prepare_test_case(tc)
 
     print(f"[bench] Running {len(test_cases)} queries against {args.server}...")
 
-    cases, latencies, cache_hits = run_benchmarks(args.server, test_cases, args.limit)
-    stats = build_project_stats(cases, latencies, cache_hits)
+    cols = run_benchmarks(args.server, test_cases, args.limit, args.concurrency, args.qps)
+    stats = build_project_stats(cols)
+    cases = case_records(cols)
 
     project_entry = {
         "name": args.project,
         "repo": args.repo or args.project,
         "language": args.lang or "Unknown",
         "framework": args.framework or "Unknown",
+        "latency_concurrency": max(1, args.concurrency),
         "stats": stats,
         "cases": cases,
     }
 
     if args.append and OUTPUT_PATH.exists():
-        with open(OUTPUT_PATH) as f:
-            existing = json.load(f)
+        existing = load_json(OUTPUT_PATH)
         projects = existing.get("projects", [])
         projects = [p for p in projects if p["name"] != args.project]
         projects.append(project_entry)
     else:
         projects = [project_entry]
 
-    all_stats = [p["stats"] for p in projects if p.get("stats")]
-    total_queries = sum(s.get("queries_tested", 0) for s in all_stats)
     benchmarks = {
         "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "projects": projects,
-        "aggregate": {
-            "total_projects": len(projects),
-            "total_queries": total_queries,
-            "avg_token_reduction_pct": round(
-                sum(s.get("token_reduction_pct", 0) for s in all_stats) / len(all_stats), 1
-            ) if all_stats else 0,
-            "avg_latency_ms": round(
-                sum(s.get("avg_latency_ms", 0) for s in all_stats) / len(all_stats)
-            ) if all_stats else 0,
-            "avg_flow_hit_rate": round(
-                sum(s.get("flow_hit_rate", 0) for s in all_stats) / len(all_stats), 3
-            ) if all_stats else 0,
-            "avg_cache_hit_rate": round(
-                sum(s.get("cache_hit_rate", 0) for s in all_stats) / len(all_stats), 3
-            ) if all_stats else 0,
-        },
+        "aggregate": build_aggregate(projects),
     }
 
-    with open(OUTPUT_PATH, "w") as f:
-        json.dump(benchmarks, f, indent=2)
+    dump_json(OUTPUT_PATH, benchmarks)
 
     n = len(cases)
     print(f"\n{'=' * 50}")
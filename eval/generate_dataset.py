@@ -18,43 +18,72 @@ Usage:
 """
 
 import argparse
-import json
-import random
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
+import numpy as np
 import requests
 
+from eval_common import CodeprismError, dump_json, loads_json, make_session, response_json, unreachable
+
 CODEPRISM_DEFAULT = "http://localhost:4000"
 DEFAULT_OUTPUT = Path(__file__).parent / "golden_dataset.json"
 DEFAULT_SAMPLE = 10
 
+# camelCase boundaries and _/- separators both become a single space, so
+# _slugify scans the name once.
+_CAMEL_SPLIT = re.compile(r"(?<=[a-z])(?=[A-Z])|[_-]")
+_SLUG_CLEAN = re.compile(r"[^a-z0-9]+")
+
 
 # ─── API helpers ──────────────────────────────────────────────────────────────
 
-def api_get(server: str, path: str, params: Optional[dict] = None) -> Any:
+SESSION = make_session(retry=False)
+
+
+def api_get(
+    server: str,
+    path: str,
+    params: Optional[dict] = None,
+    session: requests.Session = SESSION,
+) -> Any:
+    """GET server+path as JSON; failures raise CodeprismError for main to report."""
     url = f"{server}{path}"
     try:
-        resp = requests.get(url, params=params, timeout=30)
+        resp = session.get(url, params=params, timeout=30)
         resp.raise_for_status()
-        return resp.json()
+        return response_json(resp)
     except requests.exceptions.ConnectionError:
-        print(f"\n[ERROR] Cannot reach codeprism at {server}.")
-        print("        Make sure the server is running: cd codeprism && pnpm dev")
-        sys.exit(1)
+        raise unreachable(server) from None
     except requests.exceptions.HTTPError as e:
-        print(f"\n[ERROR] HTTP {e.response.status_code} from {path}: {e.response.text}")
-        sys.exit(1)
+        raise CodeprismError(
+            f"[ERROR] HTTP {e.response.status_code} from {path}: {e.response.text}"
+        ) from None
 
 
 def fetch_flows(server: str) -> List[dict]:
     return api_get(server, "/api/flows")
 
 
+def _parse_source_files(files: Any) -> List[str]:
+    """source_files may arrive as a JSON-encoded string; decode it to a list."""
+    if not isinstance(files, str):
+        return files or []
+    try:
+        return loads_json(files) or []
+    except ValueError:
+        return []
+
+
 def fetch_cards(server: str, flow: str) -> List[dict]:
-    return api_get(server, "/api/cards", params={"flow": flow})
+    """Fetch a flow's cards with source_files decoded once, up front."""
+    cards = api_get(server, "/api/cards", params={"flow": flow})
+    for card in cards:
+        card["source_files"] = _parse_source_files(card.get("source_files"))
+    return cards
 
 
 # ─── Query generators ────────────────────────────────────────────────────────
@@ -62,19 +91,8 @@ def fetch_cards(server: str, flow: str) -> List[dict]:
 
 def _file_fragments(cards: List[dict]) -> List[str]:
     """Extract unique filename stems from source_files across all cards."""
-    seen = set()
-    for card in cards:
-        files = card.get("source_files", "")
-        if isinstance(files, str):
-            try:
-                files = json.loads(files)
-            except (json.JSONDecodeError, TypeError):
-                files = []
-        for f in files:
-            stem = Path(f).stem.lower()
-            if stem and stem not in seen and len(stem) > 2:
-                seen.add(stem)
-    return sorted(seen)[:6]
+    stems = {Path(f).stem.lower() for card in cards for f in card.get("source_files", ())}
+    return sorted(s for s in stems if len(s) > 2)[:6]
 
 
 def _card_types(cards: List[dict]) -> List[str]:
@@ -90,12 +108,10 @@ def _repos(flow_meta: dict) -> List[str]:
 
 def _slugify(name: str) -> str:
     """Turn CamelCase or snake_case into readable words."""
-    s = re.sub(r"([a-z])([A-Z])", r"\1 \2", name)
-    s = s.replace("_", " ").replace("-", " ")
-    return s.lower().strip()
+    return _CAMEL_SPLIT.sub(" ", name).lower().strip()
 
 
-QUERY_TEMPLATES = [
+QUERY_TEMPLATES = (
     ("How does {readable} work in the codebase?",
      "{readable} is implemented across {file_count} files in {repo_text}. "
      "Key card types include {card_types}. Related source files include {file_list}."),
@@ -111,17 +127,17 @@ QUERY_TEMPLATES = [
     ("Where is {readable} defined and how is it used across services?",
      "{readable} has {card_count} knowledge cards ({card_types}) in {repo_text}. "
      "Important files include {file_list}."),
-]
+)
 
-CROSS_SERVICE_TEMPLATES = [
+CROSS_SERVICE_TEMPLATES = (
     ("How do {parts[0]} and {parts[1]} interact across the frontend and backend?",
      "The cross-service flow {flow_name} connects {parts[0]} and {parts[1]}. "
      "It spans {repo_text} with {card_count} cards covering {card_types}. "
      "Key files include {file_list}."),
-]
+)
 
 
-def generate_test_case(flow_meta: dict, cards: List[dict], idx: int) -> dict:
+def generate_test_case(flow_meta: dict, cards: List[dict], idx: int, rng: np.random.Generator) -> dict:
     flow_name = flow_meta["flow"]
     card_count = flow_meta.get("cardCount", len(cards))
     file_count = flow_meta.get("fileCount", 0)
@@ -147,14 +163,14 @@ def generate_test_case(flow_meta: dict, cards: List[dict], idx: int) -> dict:
     )
 
     if is_cross_service and len(parts) >= 2:
-        template = random.choice(CROSS_SERVICE_TEMPLATES)
+        template = CROSS_SERVICE_TEMPLATES[rng.integers(len(CROSS_SERVICE_TEMPLATES))]
     else:
         template = QUERY_TEMPLATES[idx % len(QUERY_TEMPLATES)]
 
     query = template[0].format(**fmt_vars)
     ground_truth = template[1].format(**fmt_vars)
 
-    case_id = re.sub(r"[^a-z0-9]+", "-", flow_name.lower()).strip("-")
+    case_id = _SLUG_CLEAN.sub("-", flow_name.lower()).strip("-")
 
     expected_flows = [flow_name]
     if is_cross_service:
@@ -172,7 +188,7 @@ def generate_test_case(flow_meta: dict, cards: List[dict], idx: int) -> dict:
 
 # ─── Sampling strategy ───────────────────────────────────────────────────────
 
-def select_flows(flows: List[dict], sample: int) -> List[dict]:
+def select_flows(flows: List[dict], sample: int, rng: np.random.Generator) -> List[dict]:
     """Pick a diverse sample: prefer flows with more cards/files, mix repos."""
     if len(flows) <= sample:
         return flows
@@ -180,21 +196,24 @@ def select_flows(flows: List[dict], sample: int) -> List[dict]:
     cross_service = [f for f in flows if "↔" in f["flow"]]
     regular = [f for f in flows if "↔" not in f["flow"]]
 
-    regular.sort(key=lambda f: f.get("cardCount", 0), reverse=True)
+    # Split regular flows into the higher/lower cardCount halves with an
+    # O(n) partition; both halves are sampled, so neither needs sorting.
+    counts = np.fromiter((f.get("cardCount", 0) for f in regular), dtype=np.int64, count=len(regular))
+    midpoint = len(regular) // 2
+    order = np.argpartition(-counts, midpoint) if midpoint else np.arange(len(regular))
+    top_half, bottom_half = order[:midpoint], order[midpoint:]
 
     selected: List[dict] = []
     cs_budget = min(len(cross_service), max(1, sample // 4))
-    selected.extend(random.sample(cross_service, cs_budget) if cross_service else [])
+    if cross_service:
+        selected.extend(cross_service[i] for i in rng.choice(len(cross_service), cs_budget, replace=False))
 
     remaining = sample - len(selected)
-    top_half = regular[: len(regular) // 2]
-    bottom_half = regular[len(regular) // 2:]
-
     top_pick = min(remaining * 2 // 3, len(top_half))
     bottom_pick = min(remaining - top_pick, len(bottom_half))
 
-    selected.extend(random.sample(top_half, top_pick) if top_half else [])
-    selected.extend(random.sample(bottom_half, bottom_pick) if bottom_half else [])
+    selected.extend(regular[i] for i in rng.choice(top_half, top_pick, replace=False))
+    selected.extend(regular[i] for i in rng.choice(bottom_half, bottom_pick, replace=False))
 
     return selected[:sample]
 
@@ -211,8 +230,16 @@ def main() -> None:
     parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible sampling")
     args = parser.parse_args()
 
-    if args.seed is not None:
-        random.seed(args.seed)
+    try:
+        generate(args)
+    except CodeprismError as e:
+        print(f"\n{e}")
+        sys.exit(1)
+
+
+def generate(args: argparse.Namespace) -> None:
+    """Build and write the dataset; API failures propagate as CodeprismError."""
+    rng = np.random.default_rng(args.seed)
 
     output_path = Path(args.output) if args.output else DEFAULT_OUTPUT
 
@@ -228,15 +255,22 @@ def main() -> None:
         print("[ERROR] No flows found. Is the database indexed?")
         sys.exit(1)
 
-    selected = select_flows(flows, args.sample)
+    selected = select_flows(flows, args.sample, rng)
     print(f"[generate] Sampling {len(selected)} flows for test cases…")
 
+    # Card fetches are independent network calls: overlap them. Test case
+    # generation stays sequential so seeded sampling is reproducible.
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(selected)))) as pool:
+        try:
+            all_cards = list(pool.map(lambda f: fetch_cards(args.server, f["flow"]), selected))
+        except CodeprismError:
+            pool.shutdown(cancel_futures=True)  # don't keep fetching for a dead server
+            raise
+
     test_cases: List[dict] = []
-    for idx, flow_meta in enumerate(selected):
-        flow_name = flow_meta["flow"]
-        print(f"  → {flow_name} ({flow_meta.get('cardCount', '?')} cards)")
-        cards = fetch_cards(args.server, flow_name)
-        tc = generate_test_case(flow_meta, cards, idx)
+    for idx, (flow_meta, cards) in enumerate(zip(selected, all_cards)):
+        print(f"  → {flow_meta['flow']} ({flow_meta.get('cardCount', '?')} cards)")
+        tc = generate_test_case(flow_meta, cards, idx, rng)
         test_cases.append(tc)
 
     dataset = {
@@ -248,8 +282,7 @@ def main() -> None:
         "test_cases": test_cases,
     }
 
-    with open(output_path, "w") as f:
-        json.dump(dataset, f, indent=2)
+    dump_json(output_path, dataset)
 
     print(f"\n[generate] Wrote {len(test_cases)} test cases → {output_path}")
     print(f"[generate] Run evaluation with:  python evaluate.py")
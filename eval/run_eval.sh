@@ -83,6 +83,10 @@ echo "  Server : $CODEPRISM_SERVER"
 echo "  Judge  : $JUDGE_LLM"
 echo ""
 
+# Results land in the history ledger under the current git SHA, so never
+# score cached search results (even if --search-cache is passed through "$@").
+export AI_CACHE_FORCE_REFRESH=1
+
 python3 evaluate.py --ragas --server "$CODEPRISM_SERVER" "$@"
 
 # ── DeepEval (per-card contextual relevance) ──────────────────────────
@@ -97,22 +101,21 @@ if [ -f eval_results.json ]; then
   GIT_SHA=$(git -C "$(dirname "$SCRIPT_DIR")" rev-parse --short HEAD 2>/dev/null || echo "unknown")
   node -e "
     const fs = require('fs');
-    const histPath = './history.json';
+    const histPath = './history.jsonl';
     const resultsPath = './eval_results.json';
     try {
-      const history = JSON.parse(fs.readFileSync(histPath, 'utf8'));
       const results = JSON.parse(fs.readFileSync(resultsPath, 'utf8'));
       const agg = results.aggregate_ragas || results.aggregate_deterministic || {};
-      history.push({
+      const entry = {
         timestamp: new Date().toISOString(),
         git_sha: '${GIT_SHA}',
         tool: 'ragas',
         ...agg,
-      });
-      fs.writeFileSync(histPath, JSON.stringify(history, null, 2));
-      console.log('  History ledger updated: history.json');
+      };
+      fs.appendFileSync(histPath, JSON.stringify(entry) + '\\n');
+      console.log('  History ledger updated: history.jsonl');
     } catch(e) {
-      console.warn('  [warn] Could not update history.json:', e.message);
+      console.warn('  [warn] Could not update history.jsonl:', e.message);
     }
   " 2>/dev/null || true
 fi